@@ -0,0 +1,8 @@
+"""ASGI entry point.
+
+Run with: hypercorn asgi:app -b 0.0.0.0:$PORT -w 4 -k uvloop
+
+Importing app here means the pooled client and compiled byte regexes
+are all built at load time, before workers start serving.
+"""
+from app import app  # noqa: F401